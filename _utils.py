@@ -0,0 +1,57 @@
+import glob
+import hashlib
+import json
+import os
+import pickle
+from functools import lru_cache
+
+try:
+    import orjson
+except ImportError:  # optional speedup, stdlib json works fine without it
+    orjson = None
+
+def json_loads(text):
+    """Decode JSON text with orjson when available, stdlib json otherwise."""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+@lru_cache(maxsize=8)
+def _load_threat_index(threats_path, mtime):
+    """Parse the threats file; mtime is part of the key for invalidation."""
+    with open(threats_path, "r", encoding="utf-8") as f:
+        data = json_loads(f.read())
+    return {t["id"]: t for t in data if "id" in t}
+
+def build_threat_index(threats_path):
+    """Load threats into a dictionary keyed by ID, cached on path + mtime."""
+    return _load_threat_index(threats_path, os.path.getmtime(threats_path))
+
+def cached_layout(tag, input_paths, compute, use_cache=True):
+    """
+    Return a graph layout, cached on disk keyed by input-file mtimes.
+
+    The graph structure is fully determined by the input files, so as long
+    as their mtimes are unchanged the pickled positions from a previous run
+    can be reused and the layout step skipped. Pass use_cache=False to
+    force recomputation.
+    """
+    if not use_cache:
+        return compute()
+    # Key on path + mtime + size: mtimes alone collide whenever different
+    # files share second-granularity timestamps (git clone, cp -p, tar)
+    key = hashlib.md5()
+    for p in input_paths:
+        st = os.stat(p)
+        key.update(f"{os.path.abspath(p)}:{st.st_mtime_ns}:{st.st_size};".encode())
+    cache_path = f".layout-{tag}-{key.hexdigest()}.pkl"
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+    pos = compute()
+    # Prune superseded entries for this tag so stale pickles don't pile up
+    for old in glob.glob(f".layout-{tag}-*.pkl"):
+        os.remove(old)
+    with open(cache_path, "wb") as f:
+        pickle.dump(pos, f)
+    return pos
@@ -1,54 +1,47 @@
-import json
+import itertools
+import multiprocessing
 import networkx as nx
 import matplotlib.pyplot as plt
 
-def build_threat_index(threats_path):
-    with open(threats_path, "r", encoding="utf-8") as f:
-        threats = json.load(f)
-    return {t["id"]: t for t in threats if "id" in t}
+from _utils import build_threat_index, cached_layout, json_loads
 
-def add_tree_nodes(G, node, threat_index, parent=None, level=1, node_levels=None):
+# Above this many nodes, leaf labels are written to a sidecar file instead
+# of the figure; each label is a matplotlib Text artist and they dominate
+# render time on large trees
+LABEL_NODE_LIMIT = 150
+
+def add_tree_nodes(G, node, threat_index, parent=None, level=1, node_levels=None, counter=None):
     if node_levels is None:
         node_levels = {}
+    if counter is None:
+        counter = itertools.count()
     if "ref" in node:
         tid = node["ref"]
         threat = threat_index.get(tid, {})
         label = f"{tid}\nP={threat.get('prob','')}\n{threat.get('description','')}"
         G.add_node(tid, label=label, color="#f9f9c5", shape="box", level=level)
         node_levels[tid] = level
-        if parent:
+        if parent is not None:
             G.add_edge(parent, tid)
     else:
         logic = node.get("logic", "OR")
-        nid = str(id(node))
+        # NetworkX accepts any hashable; a deterministic int key avoids the
+        # str() per node and keeps layouts reproducible between runs
+        nid = next(counter)
         G.add_node(nid, label=logic, color="#e0e0e0", shape="ellipse", level=level)
         node_levels[nid] = level
-        if parent:
+        if parent is not None:
             G.add_edge(parent, nid)
         for child in node.get("children", []):
-            add_tree_nodes(G, child, threat_index, nid, level+1, node_levels)
+            add_tree_nodes(G, child, threat_index, nid, level+1, node_levels, counter)
     return node_levels
 
-def visualize_attack_tree(tree_path, threats_path):
-    with open(tree_path, "r", encoding="utf-8") as f:
-        tree = json.load(f)
-    threat_index = build_threat_index(threats_path)
-    G = nx.DiGraph()
-    root_label = tree.get("root", "Root")
-    root_id = "root"
-    G.add_node(root_id, label=root_label, color="#b3cde0", shape="doublecircle", level=0)
-    node_levels = {}
-    for child in tree.get("children", []):
-        node_levels.update(add_tree_nodes(G, child, threat_index, root_id, 1, node_levels))
-    node_levels[root_id] = 0
-
-    # Hierarchical layout using multipartite_layout
-    pos = nx.multipartite_layout(G, subset_key="level", align="vertical")
-
+def _render(G, pos, labels, out_path, show=False):
+    """Draw the prepared graph and write the PNG; runs in a worker process."""
     # Draw nodes with color and shape
     node_colors = [G.nodes[n].get("color", "#cccccc") for n in G.nodes()]
     nx.draw_networkx_edges(G, pos, arrows=True, arrowstyle='-|>', edge_color="#555555")
-    nx.draw_networkx_labels(G, pos, labels=nx.get_node_attributes(G, 'label'), font_size=9)
+    nx.draw_networkx_labels(G, pos, labels=labels, font_size=9)
     nx.draw_networkx_nodes(
         G, pos,
         node_color=node_colors,
@@ -60,8 +53,49 @@ def visualize_attack_tree(tree_path, threats_path):
     plt.title("Attack Tree", fontsize=14, fontweight="bold")
     plt.axis("off")
     plt.tight_layout()
-    plt.savefig("attack_tree.png")
-    plt.show()
+    plt.savefig(out_path)
+    if show:
+        plt.show()
+
+def visualize_attack_tree(tree_path, threats_path, background=True, use_cache=True):
+    with open(tree_path, "r", encoding="utf-8") as f:
+        tree = json_loads(f.read())
+    threat_index = build_threat_index(threats_path)
+    G = nx.DiGraph()
+    root_label = tree.get("root", "Root")
+    root_id = "root"
+    G.add_node(root_id, label=root_label, color="#b3cde0", shape="doublecircle", level=0)
+    node_levels = {}
+    counter = itertools.count()
+    for child in tree.get("children", []):
+        node_levels.update(add_tree_nodes(G, child, threat_index, root_id, 1, node_levels, counter))
+    node_levels[root_id] = 0
+
+    # Hierarchical layout using multipartite_layout, cached on input mtimes
+    pos = cached_layout(
+        "attacktree", [tree_path, threats_path],
+        lambda: nx.multipartite_layout(G, subset_key="level", align="vertical"),
+        use_cache=use_cache
+    )
+
+    # On large trees only label the root and logic nodes and emit the leaf
+    # labels as a sidecar text file
+    out_path = "attack_tree.png"
+    labels = nx.get_node_attributes(G, 'label')
+    if G.number_of_nodes() > LABEL_NODE_LIMIT:
+        leaf_labels = [labels[n] for n in G.nodes() if n in threat_index]
+        with open(f"{out_path}.labels.txt", "w", encoding="utf-8") as f:
+            f.write("\n\n".join(leaf_labels))
+        labels = {n: lbl for n, lbl in labels.items() if n not in threat_index}
+
+    # Render in a worker process so PNG encoding overlaps with whatever the
+    # caller does next; background=False draws inline and opens the window.
+    if background:
+        proc = multiprocessing.Process(target=_render, args=(G, pos, labels, out_path))
+        proc.start()
+        return proc
+    _render(G, pos, labels, out_path, show=True)
+    return None
 
 if __name__ == "__main__":
-    visualize_attack_tree("attack_tree.json", "smarttv_threats.json")
\ No newline at end of file
+    visualize_attack_tree("attack_tree.json", "smarttv_threats.json", background=False)
\ No newline at end of file
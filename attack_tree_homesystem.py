@@ -1,18 +1,24 @@
-import json
+import multiprocessing
+from collections import defaultdict
 import networkx as nx
 import matplotlib.pyplot as plt
-import pydot as pd
 import textwrap
+from functools import lru_cache
 
-def build_threat_index(threats_path):
-    """Load threats into a dictionary keyed by ID."""
-    with open(threats_path, "r") as f:
-        data = json.load(f)
-    return {t["id"]: t for t in data if "id" in t}
+from _utils import build_threat_index, cached_layout
 
+# Above this many nodes, per-threat labels are written to a sidecar file
+# instead of the figure; each label is a matplotlib Text artist and they
+# dominate render time on large trees
+LABEL_NODE_LIMIT = 150
+
+@lru_cache(maxsize=None)
+def _dread_score(items):
+    return sum(v for _, v in items) / 5.0
 
 def calculate_dread_score(d):
-    return sum(d.values()) / 5.0
+    # Freeze the dict to a sorted tuple so identical DREAD vectors hit the cache
+    return _dread_score(tuple(sorted(d.items())))
 
 def determine_severity(score):
     if score >= 8: return "Critical"
@@ -20,8 +26,34 @@ def determine_severity(score):
     if score >= 4: return "Medium"
     return "Low"
 
-def visualize_attack_tree(threats_path, out_path):
-    threat_index = build_threat_index(threats_path)
+def _render(G, pos, colors, node_sizes, labels, out_path):
+    """Draw the prepared graph and write the PNG; runs in a worker process."""
+    plt.figure(figsize=(18, 12))
+    nx.draw_networkx_nodes(G, pos, node_color=colors, node_size=node_sizes, alpha=0.95)
+    nx.draw_networkx_edges(G, pos, arrows=True, arrowstyle='-|>', arrowsize=18, width=1.8, connectionstyle='arc3,rad=0.15', edge_color="#0EB0D8")
+    nx.draw_networkx_labels(G, pos, labels=labels, font_size=9, font_weight="bold")
+
+    # Add legend
+    import matplotlib.patches as mpatches
+    legend_handles = [
+        mpatches.Patch(color="#B7CFDC", label="Root (System)"),
+        mpatches.Patch(color="#c7e9c0", label="Device"),
+        mpatches.Patch(color="#fdd0a2", label="Threat"),
+    ]
+    plt.legend(handles=legend_handles, loc="upper left", fontsize=11, frameon=True)
+
+    plt.title("IoT Home System Attack Tree", fontsize=18, fontweight="bold", pad=20)
+    plt.axis("off")
+    plt.tight_layout()
+    # tight_layout above already fits the axes; bbox_inches="tight" would
+    # render the whole figure a second time just to measure it.
+    plt.savefig(out_path, dpi=150)
+    plt.close()
+    print(f"Attack tree saved to {out_path}")
+
+def visualize_attack_tree(threats_path, out_path, threat_index=None, background=True, use_cache=True):
+    if threat_index is None:
+        threat_index = build_threat_index(threats_path)
 
     G = nx.DiGraph()
 
@@ -29,8 +61,11 @@ def visualize_attack_tree(threats_path, out_path):
     meta_root = "Compromise Smart Home IoT System"
     G.add_node(meta_root, type="root")
 
-    # Get all devices
-    devices = sorted(set(t["device"] for t in threat_index.values()))
+    # Group threats by device once instead of rescanning the index per device
+    by_dev = defaultdict(list)
+    for tid, t in threat_index.items():
+        by_dev[t["device"]].append((tid, t))
+    devices = sorted(by_dev)
 
     # Build subtrees per device
     for dev in devices:
@@ -39,13 +74,12 @@ def visualize_attack_tree(threats_path, out_path):
         G.add_edge(meta_root, dev_root)
 
         # Attach threats for this device
-        for tid, t in threat_index.items():
-            if t["device"] == dev:
-                score = calculate_dread_score(t["dread"])
-                sev = determine_severity(score)
-                label = f"{tid}: {t['description']}\n \n Impact~{sev} | Likelihood~{t['prob']}"
-                G.add_node(label, type="threat")
-                G.add_edge(dev_root, label)
+        for tid, t in by_dev[dev]:
+            score = calculate_dread_score(t["dread"])
+            sev = determine_severity(score)
+            label = f"{tid}: {t['description']}\n \n Impact~{sev} | Likelihood~{t['prob']}"
+            G.add_node(label, type="threat")
+            G.add_edge(dev_root, label)
 
     # Assign subset attribute for multipartite layout
     for n in G.nodes():
@@ -56,11 +90,14 @@ def visualize_attack_tree(threats_path, out_path):
         else:
             G.nodes[n]['subset'] = 2
 
-    # Use Graphviz hierarchical layout for better grouping
-    try:
-        pos = nx.nx_agraph.graphviz_layout(G, prog="dot")
-    except ImportError:
-        pos = nx.spring_layout(G, seed=42)  # fallback
+    # Deterministic hierarchical layout from the subset attributes; avoids
+    # shelling out to Graphviz dot or falling back to spring_layout.
+    # Cached on the threats file mtime since it fully determines the graph.
+    pos = cached_layout(
+        "homesystem", [threats_path],
+        lambda: nx.multipartite_layout(G, subset_key="subset", align="vertical"),
+        use_cache=use_cache
+    )
 
     # Colors by type
     colors = []
@@ -87,26 +124,22 @@ def visualize_attack_tree(threats_path, out_path):
         else:
             labels[n] = n
 
-    plt.figure(figsize=(18, 12))
-    nx.draw_networkx_nodes(G, pos, node_color=colors, node_size=node_sizes, alpha=0.95)
-    nx.draw_networkx_edges(G, pos, arrows=True, arrowstyle='-|>', arrowsize=18, width=1.8, connectionstyle='arc3,rad=0.15', edge_color="#0EB0D8")
-    nx.draw_networkx_labels(G, pos, labels=labels, font_size=9, font_weight="bold")
-
-    # Add legend
-    import matplotlib.patches as mpatches
-    legend_handles = [
-        mpatches.Patch(color="#B7CFDC", label="Root (System)"),
-        mpatches.Patch(color="#c7e9c0", label="Device"),
-        mpatches.Patch(color="#fdd0a2", label="Threat"),
-    ]
-    plt.legend(handles=legend_handles, loc="upper left", fontsize=11, frameon=True)
-
-    plt.title("IoT Home System Attack Tree", fontsize=18, fontweight="bold", pad=20)
-    plt.axis("off")
-    plt.tight_layout()
-    plt.savefig(out_path, bbox_inches="tight", dpi=150)
-    plt.close()
-    print(f"Attack tree saved to {out_path}")
+    # On large trees only label the root and device nodes and emit the
+    # threat labels as a sidecar text file
+    if G.number_of_nodes() > LABEL_NODE_LIMIT:
+        threat_labels = [n for n, d in G.nodes(data=True) if d["type"] == "threat"]
+        with open(f"{out_path}.labels.txt", "w", encoding="utf-8") as f:
+            f.write("\n\n".join(threat_labels))
+        labels = {n: labels[n] for n, d in G.nodes(data=True) if d["type"] != "threat"}
+
+    # Render in a worker process so PNG encoding overlaps with whatever the
+    # caller does next; pass background=False to draw inline (debugging).
+    if background:
+        proc = multiprocessing.Process(target=_render, args=(G, pos, colors, node_sizes, labels, out_path))
+        proc.start()
+        return proc
+    _render(G, pos, colors, node_sizes, labels, out_path)
+    return None
 
 if __name__ == "__main__":
     visualize_attack_tree("HomeSystem_Threats.json", "HomeSystem_attack_tree.png")
@@ -1,12 +1,25 @@
-import subprocess
-
-# Kör risk_tool.py och exportera alltid till CSV
-subprocess.run([
-    "python", "risk_tool.py", "HomeSystem_Threats.json",
-    "--tree", "attack_tree_data.json",
-    "--simulate", "10000",
-    "--csv", "threats.csv"
-])
-
-# Kör attack_tree.py (visualisering av attackträdet)
-subprocess.run(["python", "attack_tree_homesystem.py"])
\ No newline at end of file
+from _utils import json_loads
+from risk_tool import load_threats, run_risk_analysis
+from attack_tree_homesystem import visualize_attack_tree
+
+def main():
+    # Läs in indata en gång och kör verktygen i samma process
+    threats = load_threats("HomeSystem_Threats.json")
+    with open("attack_tree_data.json", "r", encoding="utf-8") as f:
+        tree = json_loads(f.read())
+
+    # Riskanalys och export till CSV
+    run_risk_analysis(threats, tree=tree, simulate=10000, csv_path="threats.csv")
+
+    # Visualisering av attackträdet, återanvänder de redan inlästa hoten
+    threat_index = {t["id"]: t for t in threats if "id" in t}
+    render_proc = visualize_attack_tree("HomeSystem_Threats.json", "HomeSystem_attack_tree.png", threat_index=threat_index)
+
+    # Vänta in renderingsprocessen och varna om den misslyckades
+    if render_proc is not None:
+        render_proc.join()
+        if render_proc.exitcode != 0:
+            print(f"Warning: attack tree rendering failed (exit code {render_proc.exitcode})")
+
+if __name__ == "__main__":
+    main()
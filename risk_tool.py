@@ -1,10 +1,17 @@
 import argparse
-import json
 import csv
-import random
+import io
+import math
+import sys
+from functools import lru_cache
 from typing import List, Dict, Any, Optional
 import numpy as np
 
+from _utils import json_loads
+
+# Shared PCG64 generator: faster per draw than the legacy Mersenne Twister
+_rng = np.random.default_rng()
+
 def load_threats(filepath: str) -> List[Dict[str, Any]]:
     """
     Load threats from a JSON or YAML file.
@@ -12,7 +19,7 @@ def load_threats(filepath: str) -> List[Dict[str, Any]]:
     with open(filepath, "r", encoding="utf-8") as file:
         content = file.read()
     try:
-        return json.loads(content)
+        return json_loads(content)
     except Exception:
         try:
             import yaml
@@ -20,13 +27,23 @@ def load_threats(filepath: str) -> List[Dict[str, Any]]:
         except Exception as e:
             raise SystemExit(f"Failed to parse {filepath} as JSON or YAML: {e}")
 
+DREAD_KEYS = ["damage", "reproducibility", "exploitability", "affected_users", "discoverability"]
+
+# Index i -> label for scores binned at (0, 5, 6.5, 8); mirrors determine_severity.
+SEVERITY_BINS = [0.0001, 5, 6.5, 8]
+SEVERITY_LABELS = np.array(["None", "Low", "Medium", "High", "Critical"])
+
+@lru_cache(maxsize=None)
+def _dread_score(values: tuple) -> float:
+    return sum(values) / len(values) if values else 0.0
+
 def calculate_dread_score(dread: Dict[str, float]) -> float:
     """
     Calculate the DREAD score for a threat.
+
+    The dict is frozen to a tuple so identical DREAD vectors hit the cache.
     """
-    keys = ["damage", "reproducibility", "exploitability", "affected_users", "discoverability"]
-    values = [float(dread.get(k, 0)) for k in keys]
-    return sum(values) / len(values) if values else 0.0
+    return _dread_score(tuple(float(dread.get(k, 0)) for k in DREAD_KEYS))
 
 def determine_severity(score: float) -> str:
     """
@@ -45,47 +62,73 @@ def determine_severity(score: float) -> str:
 def enrich_threats(threats: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """
     Attach DREAD score and severity to each threat.
+
+    Scores and severity bins are computed for all threats at once with
+    NumPy instead of per-threat Python loops.
     """
-    for threat in threats:
-        dread = threat.get("dread", {})
-        threat["score"] = calculate_dread_score(dread)
-        threat["severity"] = determine_severity(threat["score"])
+    if not threats:
+        return threats
+    arr = np.array([[float(t.get("dread", {}).get(k, 0)) for k in DREAD_KEYS] for t in threats])
+    scores = arr.mean(axis=1)
+    severities = SEVERITY_LABELS[np.digitize(scores, SEVERITY_BINS)]
+    for threat, score, severity in zip(threats, scores, severities):
+        threat["score"] = float(score)
+        threat["severity"] = str(severity)
     return threats
 
-def print_threat_report(threats: List[Dict[str, Any]], sort_key: str = "score") -> None:
+def rank_threats(threats: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Sort threats in place by descending score, then ID.
+
+    Called once so the report and export functions can iterate the list
+    directly instead of each re-sorting it.
+    """
+    threats.sort(key=lambda x: (-x.get("score", 0), x.get("id", "")))
+    return threats
+
+def print_threat_report(threats: List[Dict[str, Any]]) -> None:
     """
     Print a ranked report of threats to the console.
+
+    Expects the list to be pre-sorted by rank_threats.
     """
-    print("\n=== Ranked Threats (by DREAD score) ===")
-    print(f"{'Rank':<5} {'ID':<6} {'Score':>5}  {'Severity':<9}  {'STRIDE':<28}  Description")
-    print("-" * 100)
-    sorted_threats = sorted(threats, key=lambda x: (-x.get(sort_key, 0), x.get('id', '')))
-    for i, t in enumerate(sorted_threats, start=1):
+    lines = [
+        "\n=== Ranked Threats (by DREAD score) ===",
+        f"{'Rank':<5} {'ID':<6} {'Score':>5}  {'Severity':<9}  {'STRIDE':<28}  Description",
+        "-" * 100
+    ]
+    for i, t in enumerate(threats, start=1):
         stride = ",".join(t.get("stride", []))
-        print(f"{i:<5} {t.get('id',''):<6} {t['score']:5.2f}  {t['severity']:<9}  {stride:<28}  {t.get('description','')}")
-    print()
+        lines.append(f"{i:<5} {t.get('id',''):<6} {t['score']:5.2f}  {t['severity']:<9}  {stride:<28}  {t.get('description','')}")
+    lines.append("\n")
+    sys.stdout.write("\n".join(lines))
 
 def export_threats_csv(threats: List[Dict[str, Any]], filepath: str) -> None:
     """
     Export the ranked threats to a CSV file.
     """
     fieldnames = ["rank", "id", "score", "severity", "stride", "location", "description", "mitigations", "prob"]
-    sorted_threats = sorted(threats, key=lambda x: (-x.get("score", 0), x.get("id", "")))
+    rows = [
+        (
+            i,
+            t.get("id", ""),
+            f"{t['score']:.2f}",
+            t["severity"],
+            "|".join(t.get("stride", [])),
+            t.get("location", ""),
+            t.get("description", ""),
+            "; ".join(t.get("mitigations", [])),
+            t.get("prob", "")
+        )
+        for i, t in enumerate(threats, start=1)
+    ]
+    # Build the CSV in memory and flush it with one write
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(fieldnames)
+    writer.writerows(rows)
     with open(filepath, "w", newline="", encoding="utf-8") as file:
-        writer = csv.DictWriter(file, fieldnames=fieldnames)
-        writer.writeheader()
-        for i, t in enumerate(sorted_threats, start=1):
-            writer.writerow({
-                "rank": i,
-                "id": t.get("id", ""),
-                "score": f"{t['score']:.2f}",
-                "severity": t["severity"],
-                "stride": "|".join(t.get("stride", [])),
-                "location": t.get("location", ""),
-                "description": t.get("description", ""),
-                "mitigations": "; ".join(t.get("mitigations", [])),
-                "prob": t.get("prob", "")
-            })
+        file.write(buf.getvalue())
 
 def export_threats_markdown(threats: List[Dict[str, Any]], filepath: str) -> None:
     """
@@ -96,8 +139,7 @@ def export_threats_markdown(threats: List[Dict[str, Any]], filepath: str) -> Non
         "| Rank | ID | Score | Severity | STRIDE | Location | Description | Mitigations | Prob |",
         "|---:|:--:|--:|:--:|:--|:--|:--|:--|--:|"
     ]
-    sorted_threats = sorted(threats, key=lambda x: (-x.get("score", 0), x.get("id", "")))
-    for i, t in enumerate(sorted_threats, start=1):
+    for i, t in enumerate(threats, start=1):
         lines.append(
             f"| {i} | {t.get('id','')} | {t['score']:.2f} | {t['severity']} | {'/'.join(t.get('stride', []))} | "
             f"{t.get('location','')} | {t.get('description','')} | {'; '.join(t.get('mitigations', []))} | {t.get('prob','')} |"
@@ -105,133 +147,187 @@ def export_threats_markdown(threats: List[Dict[str, Any]], filepath: str) -> Non
     with open(filepath, "w", encoding="utf-8") as file:
         file.write("\n".join(lines))
 
+def _leaf_probability(node: Optional[Dict[str, Any]], threat_index: Dict[str, Dict[str, Any]]) -> float:
+    if node is None:
+        return 0.0
+    threat = threat_index.get(node["ref"])
+    return float(threat.get("prob", 0.0)) if threat else 0.0
+
 def evaluate_attack_tree(node: Dict[str, Any], threat_index: Dict[str, Dict[str, Any]]) -> float:
     """
-    Recursively evaluate the probability of success for an attack tree node.
+    Evaluate the probability of success for an attack tree node.
+
+    Uses an iterative traversal (explicit frame stack, no recursion) and
+    accumulates products in log-space, exponentiating once per node, so
+    deep AND/OR chains neither blow the call stack nor underflow.
+
+    Children are evaluated left to right and a node short-circuits on an
+    absorbing child value (1.0 for OR, 0.0 for AND), skipping the
+    remaining subtrees entirely. The result is unchanged since those
+    values fully determine the node; only the visit order is affected.
     """
-    if node is None:
-        return 0.0
-    if "ref" in node:
-        threat = threat_index.get(node["ref"])
-        return float(threat.get("prob", 0.0)) if threat else 0.0
-    logic = node.get("logic", "OR").upper()
-    children = node.get("children", [])
-    probabilities = [evaluate_attack_tree(child, threat_index) for child in children]
-    if not probabilities:
-        return 0.0
-    if logic == "AND":
-        result = 1.0
-        for p in probabilities:
-            result *= p
-        return result
-    else:  # OR
-        result = 1.0
-        for p in probabilities:
-            result *= (1.0 - p)
-        return 1.0 - result
-
-def monte_carlo_compromise_probability(threats: List[Dict[str, Any]], iterations: int = 10000) -> (float, float):
+    if node is None or "ref" in node:
+        return _leaf_probability(node, threat_index)
+    # Frame: [node, next-child index, log-space accumulator, absorbed flag]
+    frames = [[node, 0, 0.0, False]]
+    completed: Optional[float] = None
+    while frames:
+        frame = frames[-1]
+        current = frame[0]
+        children = current.get("children", [])
+        logic = current.get("logic", "OR").upper()
+        if completed is not None:
+            # Fold the child value just finished into the current frame
+            p, completed = completed, None
+            if logic == "AND":
+                if p <= 0.0:
+                    frame[3] = True
+                else:
+                    frame[2] += math.log(p)
+            else:  # OR
+                if p >= 1.0:
+                    frame[3] = True
+                else:
+                    frame[2] += math.log1p(-p)
+        if frame[3] or frame[1] >= len(children):
+            frames.pop()
+            if not children:
+                completed = 0.0
+            elif logic == "AND":
+                completed = 0.0 if frame[3] else math.exp(frame[2])
+            else:
+                completed = 1.0 if frame[3] else 1.0 - math.exp(frame[2])
+            continue
+        child = children[frame[1]]
+        frame[1] += 1
+        if child is None or "ref" in child:
+            completed = _leaf_probability(child, threat_index)
+        else:
+            frames.append([child, 0, 0.0, False])
+    return completed
+
+MC_CHUNK_ROWS = 4096
+
+def monte_carlo_compromise_probability(threats: List[Dict[str, Any]], iterations: int = 10000,
+                                        correlated: bool = False) -> (float, float):
     """
     Calculate overall compromise probability using analytic formula and Monte Carlo simulation.
+
+    With independent threats only the boolean "any success" per iteration
+    matters, so the default path draws a single binomial with the analytic
+    compromise probability. Pass correlated=True to keep the per-threat
+    matrix simulation (chunked to MC_CHUNK_ROWS rows to cap memory) as a
+    hook for future correlated sampling.
     """
     probabilities = [float(t.get("prob", 0.0)) for t in threats if t.get("prob") is not None]
-    analytic = 1.0 - prod(1.0 - p for p in probabilities)
+    analytic = 1.0 - math.prod(1.0 - p for p in probabilities)
+    if iterations <= 0:
+        return analytic, analytic
+    if not correlated:
+        monte_carlo = int(_rng.binomial(iterations, analytic)) / iterations
+        return analytic, monte_carlo
+    # float32 halves the bandwidth of the trial matrix and is ample
+    # precision for a Bernoulli threshold comparison
+    thresholds = np.asarray(probabilities, dtype=np.float32)
     successes = 0
-    for _ in range(iterations):
-        if any(random.random() < p for p in probabilities):
-            successes += 1
-    monte_carlo = successes / iterations if iterations > 0 else analytic
-    return analytic, monte_carlo
+    for start in range(0, iterations, MC_CHUNK_ROWS):
+        rows = min(MC_CHUNK_ROWS, iterations - start)
+        draws = _rng.random((rows, thresholds.size), dtype=np.float32)
+        successes += int(np.any(draws < thresholds, axis=1).sum())
+    return analytic, successes / iterations
 
-def prod(iterable):
+class BayesianThreatBatch:
     """
-    Return the product of a sequence of numbers.
-    """
-    result = 1.0
-    for x in iterable:
-        result *= x
-    return result
+    Vectorized Bayesian updater for Bernoulli threat probabilities using Beta priors.
 
-class BayesianThreat:
-    """
-    Simple Bayesian updater for Bernoulli threat probabilities using Beta prior.
+    Holds one alpha/beta vector for all threats so observations are applied
+    as bulk counts and posterior samples come out as a single Beta matrix.
     """
-    def __init__(self, prior_alpha=1, prior_beta=1):
-        self.alpha = prior_alpha
-        self.beta = prior_beta
+    def __init__(self, n_threats: int, prior_alpha: float = 1, prior_beta: float = 1):
+        self.alpha = np.full(n_threats, float(prior_alpha))
+        self.beta = np.full(n_threats, float(prior_beta))
 
-    def update(self, observed_success: bool):
-        if observed_success:
-            self.alpha += 1
-        else:
-            self.beta += 1
+    def update(self, successes, failures):
+        """Add observation counts (scalars or per-threat vectors)."""
+        self.alpha = self.alpha + np.asarray(successes, dtype=float)
+        self.beta = self.beta + np.asarray(failures, dtype=float)
 
     @property
-    def mean(self):
+    def mean(self) -> np.ndarray:
         return self.alpha / (self.alpha + self.beta)
 
-    def sample(self):
-        return np.random.beta(self.alpha, self.beta)
+    def sample_matrix(self, iterations: int) -> np.ndarray:
+        """Draw an (iterations, n_threats) matrix of posterior samples."""
+        return _rng.beta(self.alpha, self.beta, size=(iterations, self.alpha.size))
 
-def monte_carlo_dynamic(threats: List[Dict[str, Any]], bayesian_threats: List[BayesianThreat], iterations: int = 10000) -> float:
+def monte_carlo_dynamic(threats: List[Dict[str, Any]], bayesian: BayesianThreatBatch, iterations: int = 10000) -> float:
     """
     Monte Carlo simulation using dynamic Bayesian threat probabilities.
     """
-    successes = 0
-    for _ in range(iterations):
-        probs = [bt.sample() for bt in bayesian_threats]
-        if any(random.random() < p for p in probs):
-            successes += 1
-    return successes / iterations if iterations > 0 else 0.0
+    if iterations <= 0:
+        return 0.0
+    probs = bayesian.sample_matrix(iterations)
+    draws = _rng.random(probs.shape)
+    return int(np.any(draws < probs, axis=1).sum()) / iterations
 
-def main():
-    parser = argparse.ArgumentParser(description="IoT Threat Modeling Risk Tool (Smart TV Example)")
-    parser.add_argument("input", nargs="?", default="HomeSystem_Threats.json",
-                        help="Threats file (JSON or YAML). Default: HomeSystem_Threats.json")
-    parser.add_argument("--csv", help="Export ranked threats to CSV")
-    parser.add_argument("--md", help="Export ranked threats to Markdown")
-    parser.add_argument("--simulate", type=int, default=0, help="Run Monte Carlo with N iterations (uses per-threat 'prob')")
-    parser.add_argument("--tree", help="Attack tree JSON file (optional)")
-    args = parser.parse_args()
-    print(f"Loading threats from {args.input}...")
+def run_risk_analysis(threats: List[Dict[str, Any]], tree: Optional[Dict[str, Any]] = None,
+                      simulate: int = 0, csv_path: Optional[str] = None,
+                      md_path: Optional[str] = None) -> None:
+    """
+    Run the full analysis on pre-parsed threats (and an optional attack tree).
 
-    threats = load_threats(args.input)
+    Takes already-loaded data so callers like main.py can parse each JSON
+    file once and drive everything in a single process.
+    """
     enrich_threats(threats)
+    rank_threats(threats)
     print_threat_report(threats)
 
-    if args.csv:
-        export_threats_csv(threats, args.csv)
-        print(f"CSV exported to {args.csv}")
-    if args.md:
-        export_threats_markdown(threats, args.md)
-        print(f"Markdown exported to {args.md}")
+    if csv_path:
+        export_threats_csv(threats, csv_path)
+        print(f"CSV exported to {csv_path}")
+    if md_path:
+        export_threats_markdown(threats, md_path)
+        print(f"Markdown exported to {md_path}")
 
-    if args.simulate:
-        analytic, monte_carlo = monte_carlo_compromise_probability(threats, iterations=args.simulate)
-        print(f"Overall compromise probability (independent threats): analytic={analytic:.3f}, MonteCarlo({args.simulate})={monte_carlo:.3f}")
+    if simulate:
+        analytic, monte_carlo = monte_carlo_compromise_probability(threats, iterations=simulate)
+        print(f"Overall compromise probability (independent threats): analytic={analytic:.3f}, MonteCarlo({simulate})={monte_carlo:.3f}")
 
         # --- Bayesian inference example ---
-        # Initialize BayesianThreats with prior (can be tuned)
-        bayesian_threats = [BayesianThreat(prior_alpha=1, prior_beta=1) for _ in threats]
+        # Initialize the batch with priors (can be tuned)
+        bayesian = BayesianThreatBatch(len(threats), prior_alpha=1, prior_beta=1)
         # Simulate some observations (for demonstration, here: 2 successes, 3 failures per threat)
-        for bt in bayesian_threats:
-            for _ in range(2):
-                bt.update(True)
-            for _ in range(3):
-                bt.update(False)
-        dynamic_mc = monte_carlo_dynamic(threats, bayesian_threats, iterations=args.simulate)
+        bayesian.update(successes=2, failures=3)
+        dynamic_mc = monte_carlo_dynamic(threats, bayesian, iterations=simulate)
         print(f"Dynamic (Bayesian) Monte Carlo compromise probability: {dynamic_mc:.3f}")
         # Show current Bayesian means for each threat
-        for t, bt in zip(threats, bayesian_threats):
-            print(f"Threat {t.get('id','')}: Bayesian mean probability = {bt.mean:.3f}")
+        for t, mean in zip(threats, bayesian.mean):
+            print(f"Threat {t.get('id','')}: Bayesian mean probability = {mean:.3f}")
 
-    if args.tree:
-        with open(args.tree, "r", encoding="utf-8") as file:
-            tree = json.load(file)
+    if tree is not None:
         threat_index = {t["id"]: t for t in threats if "id" in t}
         tree_probability = evaluate_attack_tree(tree, threat_index)
         print(f"Attack tree root '{tree.get('root', 'root')}' success probability (analytic): {tree_probability:.3f}")
 
+def main():
+    parser = argparse.ArgumentParser(description="IoT Threat Modeling Risk Tool (Smart TV Example)")
+    parser.add_argument("input", nargs="?", default="HomeSystem_Threats.json",
+                        help="Threats file (JSON or YAML). Default: HomeSystem_Threats.json")
+    parser.add_argument("--csv", help="Export ranked threats to CSV")
+    parser.add_argument("--md", help="Export ranked threats to Markdown")
+    parser.add_argument("--simulate", type=int, default=0, help="Run Monte Carlo with N iterations (uses per-threat 'prob')")
+    parser.add_argument("--tree", help="Attack tree JSON file (optional)")
+    args = parser.parse_args()
+    print(f"Loading threats from {args.input}...")
+
+    threats = load_threats(args.input)
+    tree = None
+    if args.tree:
+        with open(args.tree, "r", encoding="utf-8") as file:
+            tree = json_loads(file.read())
+    run_risk_analysis(threats, tree=tree, simulate=args.simulate, csv_path=args.csv, md_path=args.md)
+
 if __name__ == '__main__':
     main()
 # EOF